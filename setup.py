@@ -0,0 +1,25 @@
+import sys
+
+from setuptools import setup
+
+# The package is called src, which is a common name, so installing a copy of
+# it into site-packages could clash with other projects. Only editable
+# installs (pip install -e .) are supported, which point at this directory.
+if 'bdist_wheel' in sys.argv or 'install' in sys.argv:
+    sys.exit('Install this project in editable mode: pip install -e .')
+
+setup(
+    name='mimic',
+    version='0.1.0',
+    description='Detecting Acute Kidney Failure using the MIMIC Critical Care Database',
+    packages=['src'],
+    python_requires='>=3.6',
+    install_requires=['numpy', 'pandas'],
+    extras_require={
+        's3': ['boto3'],
+        'plots': ['matplotlib', 'seaborn'],
+        'modeling': ['scikit-learn', 'scipy', 'joblib'],
+        'lightgbm': ['lightgbm'],
+        'keras': ['keras', 'tensorflow'],
+    },
+)
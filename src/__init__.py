@@ -0,0 +1,8 @@
+'''
+Functions used by the notebooks to build the datasets, select patients,
+train models and visualise the results.
+
+Heavy dependencies (boto3, matplotlib, seaborn, scikit-learn, scipy) are only
+imported inside the functions that need them, so importing a module from
+this package stays cheap.
+'''
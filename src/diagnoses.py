@@ -0,0 +1,202 @@
+import pandas as pd
+import numpy as np
+
+from .s3_storage import from_s3
+
+# First 3-digit category of each ICD9 chapter (001-139 Infectious and
+# parasitic diseases, 140-239 Neoplasms, ... 800-999 Injury and poisoning).
+# V and E codes are treated as chapters of their own.
+ICD9_CHAPTER_STARTS = [1, 140, 240, 280, 290, 320, 390, 460, 520,
+                       580, 630, 680, 710, 740, 760, 780, 800]
+
+
+def icd9_rollup(codes, level='full'):
+
+    '''
+
+    Rolls ICD9 codes (as stored in MIMIC, without the decimal point) up the
+    ICD9 hierarchy.
+
+    Parameters:
+        1. codes - array/Series of ICD9 codes, eg '5849'
+        2. level - one of:
+              a) 'full' - the codes are returned unchanged
+              b) 'category' - the 3 character category (4 for E codes),
+                 eg '5849' -> '584', 'V3000' -> 'V30', 'E8497' -> 'E849'
+              c) 'chapter' - the ICD9 chapter, named by its first category,
+                 eg '5849' -> '580-629'. All V codes become 'V' and all E
+                 codes become 'E'
+
+    '''
+
+    codes = pd.Series(codes).astype(str).str.strip()
+
+    if level == 'full':
+        return codes.values
+
+    is_e = codes.str.startswith('E')
+    category = codes.str[:3].where(~is_e, codes.str[:4])
+
+    if level == 'category':
+        return category.values
+
+    if level == 'chapter':
+        chapter = codes.str[0].where(is_e | codes.str.startswith('V'))
+        numeric = chapter.isna()
+        starts = np.array(ICD9_CHAPTER_STARTS)
+        ends = np.r_[starts[1:] - 1, 999]
+        idx = np.searchsorted(starts, category[numeric].astype(int).values,
+                              side='right') - 1
+        chapter[numeric] = ['{:03d}-{:03d}'.format(starts[i], ends[i]) for i in idx]
+        return chapter.values
+
+    raise ValueError("level must be 'full', 'category' or 'chapter', not {}"
+                     .format(level))
+
+
+def diagnosis_matrix(admissions=None, level='full', exclude=None, min_count=1):
+
+    '''
+
+    Builds a sparse (CSR) matrix with one row per admission and one column
+    per ICD9 diagnosis, where 1 means the diagnosis was recorded for the
+    admission. This can be used for comorbidity features or to find
+    targets for many diagnoses at once, without the memory cost of a
+    dense one-hot pivot.
+
+    Parameters:
+        1. admissions - (optional) the admission_diagnosis_table DataFrame
+           (1 row per admission and diagnosis). Loaded from S3 if omitted
+        2. level - how far to roll the codes up the ICD9 hierarchy:
+           'full', 'category' or 'chapter' (see icd9_rollup)
+        3. exclude - (optional) list of ICD9 code prefixes to leave out
+           before rolling up, eg ['584'] drops all Acute Kidney Failure
+           codes. The diagnosis being predicted should be excluded when the
+           matrix is used for features, otherwise the target leaks in
+        4. min_count - diagnoses recorded for fewer admissions than this
+           are dropped
+
+    The output is a dictionary containing:
+        1. matrix - the admission x diagnosis CSR matrix (int8)
+        2. hadm_ids - the hadm_id of each row
+        3. codes - the diagnosis of each column
+        4. level - the level the codes were rolled up to
+
+    '''
+
+    from scipy import sparse
+
+    if admissions is None:
+        admissions = from_s3(bucket='mimic-jamesi',
+                             filepath='data/admission_diagnosis_table.csv',
+                             index_col=0)
+
+    df = admissions.loc[admissions['diagnosis_icd9'].notna(),
+                        ['hadm_id', 'diagnosis_icd9']]
+    codes = df['diagnosis_icd9'].astype(str).str.strip()
+
+    if exclude:
+        keep = ~codes.str.startswith(tuple(exclude))
+        df, codes = df[keep], codes[keep]
+
+    rows, hadm_ids = pd.factorize(df['hadm_id'].astype(int), sort=True)
+    cols, code_names = pd.factorize(icd9_rollup(codes, level=level), sort=True)
+
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                               shape=(len(hadm_ids), len(code_names)))
+
+    # Duplicates (eg several codes rolled up into one) are summed when the
+    # matrix is built, so set everything back to 1
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    if min_count > 1:
+        keep_cols = np.flatnonzero(np.asarray(matrix.sum(axis=0)).ravel() >= min_count)
+        matrix = matrix[:, keep_cols]
+        code_names = code_names[keep_cols]
+
+    return {'matrix': matrix,
+            'hadm_ids': np.asarray(hadm_ids),
+            'codes': np.asarray(code_names),
+            'level': level}
+
+
+def select_admissions(diagnoses, hadm_ids):
+
+    '''
+
+    Takes the rows of a diagnosis matrix (the output of diagnosis_matrix)
+    for a list of admissions, in the order given. Admissions that aren't in
+    the matrix get a row of zeros.
+
+    The output is a CSR matrix with one row per hadm_id.
+
+    '''
+
+    from scipy import sparse
+
+    hadm_ids = np.asarray(hadm_ids).astype(int)
+    positions = pd.Index(diagnoses['hadm_ids']).get_indexer(hadm_ids)
+    found = np.flatnonzero(positions >= 0)
+
+    # Multiplying by a selection matrix picks out (and re-orders) the rows,
+    # leaving zeros for the admissions that weren't found
+    selector = sparse.csr_matrix((np.ones(len(found), dtype=np.int8),
+                                  (found, positions[found])),
+                                 shape=(len(hadm_ids), diagnoses['matrix'].shape[0]))
+
+    return (selector * diagnoses['matrix']).tocsr()
+
+
+def drop_diagnoses(diagnoses, codes):
+
+    '''
+
+    Removes the columns of a diagnosis matrix (the output of
+    diagnosis_matrix) that contain any of the given ICD9 codes, after
+    rolling them up to the matrix's level. Used to stop the diagnosis being
+    predicted from leaking into the features, eg '5849' removes the '584'
+    column of a category level matrix.
+
+    The output is a diagnosis matrix dictionary without those columns.
+
+    '''
+
+    level = diagnoses.get('level', 'full')
+    drop = set(icd9_rollup(np.atleast_1d(codes), level=level))
+    keep = np.flatnonzero([c not in drop for c in diagnoses['codes']])
+
+    return dict(diagnoses,
+                matrix=diagnoses['matrix'][:, keep],
+                codes=diagnoses['codes'][keep])
+
+
+def diagnosis_targets(diagnoses, hadm_ids, codes=None):
+
+    '''
+
+    Finds multi-label targets for a list of admissions: one column per
+    diagnosis, with 1 if the admission had that diagnosis.
+
+    Parameters:
+        1. diagnoses - the output of diagnosis_matrix
+        2. hadm_ids - the admissions, in the order the targets are needed
+        3. codes - (optional) the diagnoses to return. All are returned
+           if omitted
+
+    The output is a tuple of the CSR target matrix and the codes of its
+    columns.
+
+    '''
+
+    Y = select_admissions(diagnoses, hadm_ids)
+
+    if codes is None:
+        return Y, diagnoses['codes']
+
+    cols = pd.Index(diagnoses['codes']).get_indexer(codes)
+    if (cols < 0).any():
+        raise ValueError('Diagnoses not in the matrix: {}'
+                         .format(list(np.asarray(codes)[cols < 0])))
+
+    return Y[:, cols], diagnoses['codes'][cols]
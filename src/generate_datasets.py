@@ -1,14 +1,9 @@
-import os
-import sys
 import pandas as pd
 import numpy as np
 
-# Set up paths & import functions
-project_root = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-src_folder = os.path.join(project_root, 'src')
-sys.path.insert(0, src_folder)
-from s3_storage import *
-from utilities import *
+# Import src functions
+from .s3_storage import from_s3
+from .utilities import lowercase_columns
 
 def create_admission_diagnosis_table():
 
@@ -175,4 +170,26 @@ def create_admission_diagnosis_table():
     df.drop_duplicates(inplace=True)
     df.reset_index(inplace=True, drop=True)
 
-    return df
\ No newline at end of file
+    return df
+
+
+def get_events(dataset, ids):
+
+    '''
+
+    Pulls the chart or lab events for a list of itemids from the raw data.
+
+    Parameters:
+        1. dataset - the raw data file to read, eg 'LABEVENTS' or 'CHARTEVENTS'
+        2. ids - list of the itemids that should be kept
+
+    '''
+
+    df = from_s3('mimic-jamesi', 'raw_data/{}.csv'.format(dataset))
+    df = lowercase_columns(df)
+    df = df[['subject_id', 'hadm_id', 'charttime', 'itemid' ,'valuenum']]
+    df = df[df['itemid'].isin(ids)]
+    df['charttime'] = pd.to_datetime(df['charttime'])
+    df.dropna(inplace=True)
+    df.drop_duplicates(inplace=True)
+    return df
@@ -0,0 +1,464 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+from .s3_storage import file_from_s3
+from .model_artifacts import save_model_artifact
+
+
+def _s3_etag(s3, bucket, filepath):
+
+    ''' The ETag of a file on S3, or None if it doesn't exist '''
+
+    from botocore.exceptions import ClientError
+
+    try:
+        return s3.head_object(Bucket=bucket, Key=filepath)['ETag']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+
+def open_train_set(diagnosis_name, split='train', bucket='mimic-jamesi',
+                   cache_dir=None, refresh=False):
+
+    '''
+
+    Downloads the X, y and feature name arrays saved by 1_select_patients
+    to a local cache and opens them without reading them into memory. Dense
+    (.npy) feature sets are memory-mapped, so rows are only read from disk
+    when a batch needs them. Sparse feature sets (.npz, eg with diagnosis
+    features added) are loaded into memory, as they are already compact.
+
+    Parameters:
+        1. diagnosis_name - the name the datasets were saved under, eg
+           'acute_kidney_failure'
+        2. split - 'train' or 'test'
+        3. bucket - the S3 bucket the datasets are in
+        4. cache_dir - local directory the files are downloaded to. Cached
+           files are only downloaded again if they have changed on S3
+           (their ETag is different)
+        5. refresh - if True, the files are always downloaded again
+
+    The output is a tuple of (X, y, feature_names).
+
+    '''
+
+    import boto3
+
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), 'mimic_data')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    s3 = boto3.client('s3')
+
+    arrays = []
+    for name in ['X_{}'.format(split), 'y_{}'.format(split), 'feature_names']:
+
+        # Only X can be sparse
+        extensions = ['npy', 'npz'] if name.startswith('X') else ['npy']
+        for ext in extensions:
+            filename = '{}_{}.{}'.format(diagnosis_name, name, ext)
+            etag = _s3_etag(s3, bucket, 'data/{}'.format(filename))
+            if etag is not None:
+                break
+        else:
+            raise FileNotFoundError('{}_{} not found in s3://{}/data'
+                                    .format(diagnosis_name, name, bucket))
+
+        local_path = os.path.join(cache_dir, filename)
+        etag_path = local_path + '.etag'
+
+        cached_etag = None
+        if os.path.exists(local_path) and os.path.exists(etag_path):
+            with open(etag_path, 'r') as file:
+                cached_etag = file.read()
+
+        if refresh or cached_etag != etag:
+            if os.path.exists(etag_path):
+                os.remove(etag_path)
+            file_from_s3(bucket, 'data/{}'.format(filename), local_path, s3=s3)
+            # Written after the download, so a partial file is never reused
+            with open(etag_path, 'w') as file:
+                file.write(etag)
+
+        if ext == 'npz':
+            from scipy import sparse
+            arrays.append(sparse.load_npz(local_path).tocsr())
+        else:
+            arrays.append(np.load(local_path, mmap_mode='r'))
+
+    return tuple(arrays)
+
+
+def iter_batches(X, y, batch_size=10000, shuffle=True, random_state=8,
+                 dtype=None):
+
+    '''
+
+    Yields (X_batch, y_batch) pairs covering X and y once, reading one
+    batch at a time so memory use depends on batch_size rather than the
+    size of the training set.
+
+    When shuffle is True, the batches are taken in a random order and the
+    rows within each batch are shuffled. Whole batches are read from
+    contiguous rows, which is much faster on a memory-mapped file than
+    reading rows in a random order.
+
+    Parameters:
+        1. X, y - the feature set (np.array, memmap or sparse matrix) and
+           target variable
+        2. batch_size - the number of rows in each batch
+        3. shuffle - whether to shuffle the batches
+        4. random_state - seed for the shuffle
+        5. dtype - (optional) dtype to cast each X batch to, eg np.float32
+
+    '''
+
+    n = X.shape[0]
+    starts = np.arange(0, n, batch_size)
+    rng = np.random.RandomState(random_state)
+
+    if shuffle:
+        rng.shuffle(starts)
+
+    for start in starts:
+        X_batch = X[start:start + batch_size]
+        y_batch = np.asarray(y[start:start + batch_size])
+
+        if shuffle:
+            order = rng.permutation(len(y_batch))
+            X_batch = X_batch[order]
+            y_batch = y_batch[order]
+
+        if dtype is not None:
+            X_batch = X_batch.astype(dtype)
+        elif isinstance(X_batch, np.memmap):
+            X_batch = np.asarray(X_batch)
+
+        yield X_batch, y_batch
+
+
+def balanced_class_weights(y):
+
+    '''
+
+    Equivalent of sklearn's class_weight='balanced' (which partial_fit
+    doesn't support), calculated from the target variable.
+
+    '''
+
+    classes, counts = np.unique(np.asarray(y), return_counts=True)
+    weights = len(y) / (len(classes) * counts.astype(float))
+    return dict(zip(classes, weights))
+
+
+def partial_fit_batches(model, X, y, batch_size=10000, epochs=1,
+                        random_state=8):
+
+    '''
+
+    Trains a model that supports partial_fit (eg SGDClassifier, the
+    incremental version of LogisticRegression) one batch at a time, for
+    the given number of passes over the data.
+
+    '''
+
+    classes = np.unique(np.asarray(y))
+
+    for epoch in range(epochs):
+        for X_batch, y_batch in iter_batches(X, y, batch_size=batch_size,
+                                             random_state=random_state + epoch):
+            model.partial_fit(X_batch, y_batch, classes=classes)
+
+    return model
+
+
+def final_run_incremental(X_train, y_train, best_params, classifier, model_name,
+                          feature_names, preprocessing=None, metrics=None,
+                          batch_size=10000, epochs=5, compress=0):
+
+    '''
+
+    The incremental version of modeling.final_run: trains a model that
+    supports partial_fit on batches of X_train (which can be memory-mapped,
+    see open_train_set) and saves it on S3 as a model artifact.
+
+    Parameters are the same as final_run, plus:
+        1. batch_size - the number of rows in each batch
+        2. epochs - the number of passes over the training set
+
+    If best_params sets class_weight to 'balanced', the weights are
+    calculated from y_train up front, as partial_fit can't do this itself.
+
+    '''
+
+    best_params = dict(best_params)
+    if best_params.get('class_weight') == 'balanced':
+        best_params['class_weight'] = balanced_class_weights(y_train)
+
+    model = classifier(**best_params)
+    partial_fit_batches(model, X_train, y_train,
+                        batch_size=batch_size, epochs=epochs)
+
+    save_model_artifact(model=model,
+                        model_name=model_name,
+                        feature_names=feature_names,
+                        preprocessing=preprocessing,
+                        metrics=metrics,
+                        compress=compress,
+                        bucket='mimic-jamesi')
+
+    return model
+
+
+def _fingerprint(X, y, params, chunk_size=100000):
+
+    '''
+    SHA-1 of the feature set, target variable and Dataset parameters, read
+    one chunk at a time, so a saved LightGBM Dataset can be checked against
+    the data it was built from.
+    '''
+
+    sha = hashlib.sha1()
+    sha.update(json.dumps([list(X.shape), params], sort_keys=True,
+                          default=str).encode())
+
+    for start in range(0, X.shape[0], chunk_size):
+        X_chunk = X[start:start + chunk_size]
+        if hasattr(X_chunk, 'tocsr'):
+            X_chunk = X_chunk.tocsr()
+            arrays = [X_chunk.data, X_chunk.indices, X_chunk.indptr]
+        else:
+            arrays = [X_chunk]
+        for a in arrays:
+            sha.update(np.ascontiguousarray(a, dtype=np.float64).tobytes())
+
+    sha.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+
+    return sha.hexdigest()
+
+
+def _write_text_chunk(file, X_chunk, y_chunk):
+
+    '''
+    Writes rows to a LightGBM text file, with the label first. Dense rows
+    are tab separated and sparse rows use the LibSVM format (zero-based
+    column:value pairs). Values are written with 17 significant digits,
+    enough to read back exactly the same float64.
+    '''
+
+    if not hasattr(X_chunk, 'tocsr'):
+        np.savetxt(file, np.column_stack([y_chunk, X_chunk]),
+                   delimiter='\t', fmt='%.17g')
+        return
+
+    X_chunk = X_chunk.tocsr()
+    for i in range(X_chunk.shape[0]):
+        row = slice(X_chunk.indptr[i], X_chunk.indptr[i + 1])
+        pairs = ['{}:{!r}'.format(j, float(v))
+                 for j, v in zip(X_chunk.indices[row], X_chunk.data[row])]
+        file.write(' '.join(['{!r}'.format(float(y_chunk[i]))] + pairs) + '\n')
+
+
+def lgb_dataset(X, y, path, params=None, chunk_size=100000, reference=None,
+                refresh=False):
+
+    '''
+
+    Builds a LightGBM Dataset without loading the whole feature set into
+    memory, and saves it as a LightGBM binary file (path + '.bin') so later
+    runs (eg each run of a hyperparameter search) load it directly.
+
+    The rows are written to a text file one chunk at a time (LibSVM format
+    for sparse X), and LightGBM reads the file in two passes (two_round),
+    first to find the bins for each feature and then to fill them. Only the
+    binned data is held in memory, which is much smaller than the raw
+    float64 features.
+
+    A text file is used because LightGBM 2.2 (see env.yml) can only build
+    a Dataset from a file or from an array already in memory. Values are
+    written with 17 significant digits, so LightGBM sees exactly the same
+    values as final_run would. The text copy needs about as much disk space
+    as the training set itself while the Dataset is built, and it is deleted
+    afterwards, even if the build fails.
+
+    A fingerprint of X, y and params is saved next to the binary file, and
+    the Dataset is rebuilt if they don't match it.
+
+    Parameters:
+        1. X, y - the feature set (np.array, memmap or sparse matrix) and
+           target variable
+        2. path - where to save the Dataset, without the '.bin' extension
+        3. params - (optional) LightGBM Dataset parameters, eg max_bin
+        4. chunk_size - the number of rows written at a time
+        5. reference - (optional) Dataset whose bins should be reused, eg
+           the training Dataset when building a validation Dataset. This
+           isn't part of the fingerprint, so use refresh=True if the
+           reference Dataset has been rebuilt
+        6. refresh - if True, the Dataset is always rebuilt
+
+    '''
+
+    import lightgbm as lgb
+
+    bin_path = path + '.bin'
+    fingerprint_path = bin_path + '.sha1'
+    fingerprint = _fingerprint(X, y, params, chunk_size=chunk_size)
+
+    if not refresh and os.path.exists(bin_path) and os.path.exists(fingerprint_path):
+        with open(fingerprint_path, 'r') as file:
+            if file.read() == fingerprint:
+                return lgb.Dataset(bin_path, reference=reference)
+
+    for p in [bin_path, fingerprint_path]:
+        if os.path.exists(p):
+            os.remove(p)
+
+    dataset_params = {'two_round': True, 'header': False, 'label_column': 0}
+    dataset_params.update(params or {})
+
+    text_path = path + '.txt'
+    try:
+        with open(text_path, 'w') as file:
+            for start in range(0, X.shape[0], chunk_size):
+                _write_text_chunk(file, X[start:start + chunk_size],
+                                  np.asarray(y[start:start + chunk_size]))
+
+        dataset = lgb.Dataset(text_path, params=dataset_params,
+                              reference=reference)
+        dataset.construct()
+        dataset.save_binary(bin_path)
+    finally:
+        if os.path.exists(text_path):
+            os.remove(text_path)
+
+    with open(fingerprint_path, 'w') as file:
+        file.write(fingerprint)
+
+    return dataset
+
+
+def final_run_lgb(dataset, best_params, model_name, feature_names,
+                  num_boost_round=100, preprocessing=None, metrics=None,
+                  compress=0):
+
+    '''
+
+    The out-of-core version of modeling.final_run for LightGBM: trains a
+    LightGBM model on a Dataset built by lgb_dataset and saves it on S3 as
+    a model artifact.
+
+    best_params can be the LGBMClassifier parameters found by tune_lgb, as
+    LightGBM accepts the same names. If they include n_estimators, it is
+    used as the number of boosting rounds.
+
+    The saved model is a LightGBM Booster, whose predict method returns the
+    probability of the positive class.
+
+    '''
+
+    import lightgbm as lgb
+
+    params = dict(best_params)
+    num_boost_round = int(params.pop('n_estimators', num_boost_round))
+    params.setdefault('objective', 'binary')
+
+    booster = lgb.train(params, dataset, num_boost_round=num_boost_round)
+
+    save_model_artifact(model=booster,
+                        model_name=model_name,
+                        feature_names=feature_names,
+                        preprocessing=preprocessing,
+                        metrics=metrics,
+                        compress=compress,
+                        bucket='mimic-jamesi')
+
+    return booster
+
+
+def keras_batches(X, y, batch_size=100, shuffle=True, random_state=8):
+
+    '''
+
+    Endless generator of (X_batch, y_batch) for Keras's fit_generator,
+    reshuffling the batches on each pass over the data. Sparse batches are
+    converted to dense arrays, as Keras needs dense inputs.
+
+    '''
+
+    epoch = 0
+    while True:
+        for X_batch, y_batch in iter_batches(X, y, batch_size=batch_size,
+                                             shuffle=shuffle,
+                                             random_state=random_state + epoch,
+                                             dtype=np.float32):
+            if hasattr(X_batch, 'toarray'):
+                X_batch = X_batch.toarray()
+            yield X_batch, y_batch
+        epoch += 1
+
+
+def fit_keras_batches(model, X, y, batch_size=100, epochs=1, **fit_kwargs):
+
+    '''
+
+    Trains a Keras model (eg from create_model) on batches of X and y, so
+    the training set never has to be fully in memory. Any other arguments
+    (eg class_weight, validation_data) are passed to fit_generator.
+
+    The output is the Keras History object.
+
+    '''
+
+    steps_per_epoch = int(np.ceil(X.shape[0] / float(batch_size)))
+
+    return model.fit_generator(keras_batches(X, y, batch_size=batch_size),
+                               steps_per_epoch=steps_per_epoch,
+                               epochs=epochs, **fit_kwargs)
+
+
+def final_run_keras(X_train, y_train, best_params, create_model, model_name,
+                    feature_names, batch_size=100, epochs=1, preprocessing=None,
+                    metrics=None, **fit_kwargs):
+
+    '''
+
+    The out-of-core version of the neural network's final training run:
+    creates a Keras model with create_model, trains it on batches of
+    X_train (see fit_keras_batches) and saves it on S3 as a model artifact.
+
+    Parameters:
+        1. X_train, y_train - the feature set (np.array, memmap or sparse
+           matrix) and target variable
+        2. best_params - dict of the create_model hyperparameters, eg
+           {'learn_rate': 0.04, 'hidden_layers': 1}. input_shape is set
+           from X_train
+        3. create_model - function that builds and compiles the Keras model
+        4. model_name, feature_names, preprocessing, metrics - as final_run
+        5. batch_size, epochs - as fit_keras_batches
+
+    Any other arguments (eg class_weight=balanced_class_weights(y_train))
+    are passed to fit_generator.
+
+    The output is the trained model.
+
+    '''
+
+    model = create_model(input_shape=(X_train.shape[1],), **best_params)
+    fit_keras_batches(model, X_train, y_train, batch_size=batch_size,
+                      epochs=epochs, **fit_kwargs)
+
+    save_model_artifact(model=model,
+                        model_name=model_name,
+                        feature_names=feature_names,
+                        preprocessing=preprocessing,
+                        metrics=metrics,
+                        bucket='mimic-jamesi')
+
+    return model
@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+from .s3_storage import file_from_s3, file_to_s3
+
+ARTIFACT_VERSION = 1
+METADATA_FILE = 'metadata.json'
+JOBLIB_FILE = 'model.joblib'
+KERAS_FILE = 'model.h5'
+
+# Prefix of the diagnosis features final_cleaning adds after the
+# preprocessing pipeline (see diagnoses.select_admissions)
+APPENDED_PREFIX = 'icd9_'
+
+
+def _joblib():
+
+    ''' Imports joblib, falling back to the copy bundled with older sklearn '''
+
+    try:
+        import joblib
+    except ImportError:
+        from sklearn.externals import joblib
+    return joblib
+
+
+def _is_keras(model):
+
+    ''' True if the model is a Keras model (saved as HDF5 rather than joblib) '''
+
+    return type(model).__module__.split('.')[0] == 'keras'
+
+
+def _library_versions(model):
+
+    '''
+    Finds the versions of the libraries needed to load the model, so a
+    mismatch can be flagged when the artifact is loaded somewhere else.
+    '''
+
+    libraries = {'numpy', type(model).__module__.split('.')[0]}
+    if not _is_keras(model):
+        libraries.add('joblib')
+
+    versions = {'python': '{}.{}.{}'.format(*sys.version_info[:3])}
+    for lib in sorted(libraries):
+        if lib == 'joblib':
+            versions[lib] = _joblib().__version__
+        else:
+            versions[lib] = getattr(sys.modules.get(lib), '__version__', None)
+
+    return versions
+
+
+def check_features(metadata, feature_names):
+
+    '''
+
+    Checks that feature_names matches the features (and their order) that
+    the model was trained on, raising a ValueError if it doesn't.
+
+    '''
+
+    expected = metadata['features']
+    feature_names = [str(f) for f in feature_names]
+
+    if feature_names != expected:
+        missing = [f for f in expected if f not in feature_names]
+        extra = [f for f in feature_names if f not in expected]
+        if not missing and not extra:
+            raise ValueError('Features are in a different order to the {} model'
+                             .format(metadata['model_name']))
+        raise ValueError('Features do not match the {} model. Missing: {}, unexpected: {}'
+                         .format(metadata['model_name'], missing, extra))
+
+
+def _output_width(preprocessing):
+
+    '''
+    The number of features a fitted preprocessing pipeline outputs, found
+    from its last step (eg the StandardScaler from final_cleaning). None if
+    it can't be told without data.
+    '''
+
+    step = preprocessing
+    if hasattr(step, 'steps'):
+        step = step.steps[-1][1]
+
+    for attr in ['scale_', 'mean_', 'statistics_']:
+        values = getattr(step, attr, None)
+        if values is not None:
+            return len(values)
+    return None
+
+
+def _preprocessing_features(preprocessing, features, model_name):
+
+    '''
+    The features the preprocessing pipeline produces. These are all of the
+    model's features, unless the features after the pipeline's output are
+    diagnosis columns added by final_cleaning, which the caller appends
+    with diagnoses.select_admissions. Raises a ValueError if the pipeline
+    doesn't fit the features either way.
+    '''
+
+    if preprocessing is None:
+        return []
+
+    width = _output_width(preprocessing)
+    if width is None or width == len(features):
+        return list(features)
+
+    if width < len(features) and all(f.startswith(APPENDED_PREFIX)
+                                      for f in features[width:]):
+        return list(features[:width])
+
+    raise ValueError('The preprocessing pipeline outputs {} features, but the {} '
+                     'model expects {}'.format(width, model_name, len(features)))
+
+
+def write_model_artifact(directory, model, model_name, feature_names,
+                         preprocessing=None, metrics=None, compress=0):
+
+    '''
+
+    Saves a trained model as an artifact directory containing:
+        1. metadata.json - the model name and class, the features in the
+           order the model expects them, the features the preprocessing
+           pipeline produces, the library versions used to train it and
+           any metrics passed in
+        2. model.joblib - the model and preprocessing pipeline, saved with
+           joblib. Keras models are saved as model.h5 instead.
+
+    Parameters:
+        1. directory - the local directory the artifact is written to
+        2. model - the trained model
+        3. model_name - name of the model, eg 'random_forest'
+        4. feature_names - the features of the training set, in order
+        5. preprocessing - (optional) fitted transformer that turns raw
+           features into model inputs (see final_cleaning). It must output
+           every feature, apart from any icd9_* diagnosis features at the
+           end, which are added with diagnoses.select_admissions instead
+        6. metrics - (optional) dict of scores to record, eg {'cv_auc': 0.88}
+        7. compress - joblib compression level (0-9), or a (method, level)
+           tuple such as ('lz4', 3). Compressed artifacts are smaller but
+           slower to load, as they have to be decompressed
+
+    '''
+
+    features = [str(f) for f in feature_names]
+    preprocessing_features = _preprocessing_features(preprocessing, features,
+                                                     model_name)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    metadata = {'artifact_version': ARTIFACT_VERSION,
+                'model_name': model_name,
+                'model_class': '{}.{}'.format(type(model).__module__,
+                                              type(model).__name__),
+                'features': features,
+                'preprocessing_features': preprocessing_features,
+                'library_versions': _library_versions(model),
+                'metrics': metrics or {},
+                'compress': compress,
+                'created': datetime.utcnow().isoformat()}
+
+    if _is_keras(model):
+        metadata['format'] = 'keras'
+        model.save(os.path.join(directory, KERAS_FILE))
+        _joblib().dump({'model': None, 'preprocessing': preprocessing},
+                       os.path.join(directory, JOBLIB_FILE))
+    else:
+        metadata['format'] = 'joblib'
+        _joblib().dump({'model': model, 'preprocessing': preprocessing},
+                       os.path.join(directory, JOBLIB_FILE),
+                       compress=compress)
+
+    # Written last, so a directory with metadata is always a complete artifact
+    with open(os.path.join(directory, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file, indent=2,
+                  default=lambda o: o.item() if isinstance(o, np.generic) else str(o))
+
+    return metadata
+
+
+def read_model_artifact(directory, feature_names=None, mmap=True):
+
+    '''
+
+    Loads an artifact written by write_model_artifact.
+
+    Parameters:
+        1. directory - the local artifact directory
+        2. feature_names - (optional) the features that will be passed to the
+           model. If given, they are checked against the features the model
+           was trained on
+        3. mmap - if True, numpy arrays stored directly on the model or
+           pipeline (eg the coefficients of a linear model) are
+           memory-mapped read-only from uncompressed artifacts
+
+    Memory-mapping doesn't reduce the memory used by tree models: sklearn
+    trees copy their node arrays into memory when they are unpickled, and
+    LightGBM models are stored as a model string. Uncompressed artifacts
+    still load faster, as nothing has to be decompressed.
+
+    The output is a dictionary containing the model, preprocessing and
+    metadata. metadata['preprocessing_features'] lists the features the
+    preprocessing produces; any other features (the icd9_* diagnosis
+    features) have to be appended to its output before scoring. A
+    ValueError is raised if the preprocessing doesn't produce that many
+    features.
+
+    '''
+
+    with open(os.path.join(directory, METADATA_FILE), 'r') as file:
+        metadata = json.load(file)
+
+    if metadata['artifact_version'] > ARTIFACT_VERSION:
+        raise ValueError('Artifact version {} is newer than this code supports ({})'
+                         .format(metadata['artifact_version'], ARTIFACT_VERSION))
+
+    if feature_names is not None:
+        check_features(metadata, feature_names)
+
+    mmap_mode = 'r' if mmap and not metadata['compress'] else None
+    bundle = _joblib().load(os.path.join(directory, JOBLIB_FILE),
+                            mmap_mode=mmap_mode)
+
+    if bundle['preprocessing'] is not None:
+        width = _output_width(bundle['preprocessing'])
+        expected = metadata.get('preprocessing_features', metadata['features'])
+        if width is not None and width != len(expected):
+            raise ValueError('The {} preprocessing pipeline outputs {} features, '
+                             'but {} are recorded'.format(metadata['model_name'],
+                                                          width, len(expected)))
+
+    if metadata['format'] == 'keras':
+        from keras.models import load_model
+        bundle['model'] = load_model(os.path.join(directory, KERAS_FILE))
+
+    # Flag any library versions that differ from those used in training
+    for lib, version in metadata['library_versions'].items():
+        if lib == 'python':
+            current = '{}.{}.{}'.format(*sys.version_info[:3])
+        elif lib == 'joblib':
+            current = _joblib().__version__
+        else:
+            current = getattr(sys.modules.get(lib), '__version__', version)
+        if current != version:
+            warnings.warn('{} model was saved with {} {}, but {} is installed'
+                          .format(metadata['model_name'], lib, version, current))
+
+    return {'model': bundle['model'],
+            'preprocessing': bundle['preprocessing'],
+            'metadata': metadata}
+
+
+def _artifact_files(metadata):
+
+    ''' The files that make up an artifact, with metadata.json last '''
+
+    files = [JOBLIB_FILE]
+    if metadata['format'] == 'keras':
+        files.append(KERAS_FILE)
+    return files + [METADATA_FILE]
+
+
+def save_model_artifact(model, model_name, feature_names, preprocessing=None,
+                        metrics=None, compress=0, bucket='mimic-jamesi'):
+
+    '''
+
+    Writes a model artifact (see write_model_artifact) and uploads it to
+    S3 under models/<model_name>/.
+
+    '''
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        metadata = write_model_artifact(tmp_dir, model, model_name,
+                                        feature_names,
+                                        preprocessing=preprocessing,
+                                        metrics=metrics, compress=compress)
+
+        for f in _artifact_files(metadata):
+            file_to_s3(os.path.join(tmp_dir, f), bucket,
+                       'models/{}/{}'.format(model_name, f))
+
+    return metadata
+
+
+def load_model_artifact(model_name, feature_names=None, mmap=True,
+                        bucket='mimic-jamesi', cache_dir=None, s3=None):
+
+    '''
+
+    Downloads a model artifact from S3 and loads it (see
+    read_model_artifact).
+
+    The artifact is kept in a local cache directory, which also keeps the
+    file behind any memory-mapped arrays on disk. The cached copy is reused
+    as long as its metadata matches the metadata on S3, so only the small
+    metadata file is downloaded when the model hasn't changed.
+
+    s3 is an optional boto3 S3 client to download with, which should be
+    passed in when loading from several threads (see evaluate_models).
+
+    '''
+
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), 'mimic_models')
+    local_dir = os.path.join(cache_dir, model_name)
+    if not os.path.isdir(local_dir):
+        os.makedirs(local_dir)
+
+    # Compare the latest metadata on S3 with the cached copy
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        latest = os.path.join(tmp_dir, METADATA_FILE)
+        file_from_s3(bucket, 'models/{}/{}'.format(model_name, METADATA_FILE),
+                     latest, s3=s3)
+        with open(latest, 'r') as file:
+            metadata = json.load(file)
+
+        cached = os.path.join(local_dir, METADATA_FILE)
+        up_to_date = False
+        if os.path.exists(cached):
+            with open(cached, 'r') as file:
+                up_to_date = json.load(file) == metadata
+
+        if not up_to_date:
+            if os.path.exists(cached):
+                os.remove(cached)
+            for f in _artifact_files(metadata)[:-1]:
+                file_from_s3(bucket, 'models/{}/{}'.format(model_name, f),
+                             os.path.join(local_dir, f), s3=s3)
+            shutil.copy(latest, cached)
+
+    return read_model_artifact(local_dir, feature_names=feature_names, mmap=mmap)
@@ -0,0 +1,212 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from .model_artifacts import load_model_artifact
+
+
+def _grouped_weights(y_true, y_score):
+
+    '''
+    Sorts the test set by score once so the AUC of any resample can be
+    found from the weights alone. Returns the sort order, the labels in that
+    order and the start of each group of tied scores.
+    '''
+
+    order = np.argsort(y_score, kind='mergesort')
+    sorted_scores = y_score[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_scores)) + 1]
+    return order, y_true[order], starts
+
+
+def _weighted_auc(weights, labels, starts):
+
+    '''
+    AUC (the Mann-Whitney statistic) for each row of weights, where each
+    weight is the number of times an observation was drawn in a resample.
+    Tied scores count as half, the same as roc_auc_score.
+    '''
+
+    pos = np.add.reduceat(weights * labels, starts, axis=1)
+    neg = np.add.reduceat(weights * (1 - labels), starts, axis=1)
+    neg_below = np.cumsum(neg, axis=1) - neg
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((pos * (neg_below + 0.5 * neg)).sum(axis=1) /
+                (pos.sum(axis=1) * neg.sum(axis=1)))
+
+
+def bootstrap_auc(y_true, y_score, n_bootstrap=1000, ci=0.95, random_state=8,
+                  max_chunk=5000000):
+
+    '''
+
+    Calculates the AUC with a bootstrap confidence interval.
+
+    All resamples are drawn in one pass as a matrix of indices, which is
+    turned into a matrix of counts (how many times each observation appears
+    in each resample). The AUC of every resample is then found together from
+    a single sort of the scores, rather than re-scoring each resample in a
+    Python loop.
+
+    Parameters:
+        1. y_true - (np.array) the target variable (0 or 1)
+        2. y_score - (np.array) the predicted probabilities
+        3. n_bootstrap - the number of bootstrap resamples
+        4. ci - the width of the confidence interval, eg 0.95
+        5. random_state - seed for drawing the resamples
+        6. max_chunk - the maximum number of elements in the count matrix
+           at once. Resamples are processed in chunks of this size to bound
+           memory on large test sets
+
+    The output is a tuple of (auc, lower, upper).
+
+    '''
+
+    y_true = (np.asarray(y_true) == 1).astype(float)
+    y_score = np.asarray(y_score, dtype=float).ravel()
+    n = len(y_true)
+
+    order, labels, starts = _grouped_weights(y_true, y_score)
+    auc = _weighted_auc(np.ones((1, n)), labels, starts)[0]
+
+    rng = np.random.RandomState(random_state)
+    chunk = max(1, min(n_bootstrap, max_chunk // n))
+    aucs = []
+    for start in range(0, n_bootstrap, chunk):
+        b = min(chunk, n_bootstrap - start)
+        idx = rng.randint(0, n, size=(b, n))
+        offsets = (np.arange(b) * n)[:, None]
+        counts = np.bincount((idx + offsets).ravel(),
+                             minlength=b * n).reshape(b, n)
+        aucs.append(_weighted_auc(counts[:, order], labels, starts))
+    aucs = np.concatenate(aucs)
+
+    alpha = (1 - ci) / 2
+    lower, upper = np.nanpercentile(aucs, [100 * alpha, 100 * (1 - alpha)])
+
+    return auc, lower, upper
+
+
+def _predict(model, X):
+
+    ''' Probability of the positive class '''
+
+    # LightGBM Boosters (see incremental.final_run_lgb) have no predict_proba,
+    # but their predict returns the probability for binary models
+    if not hasattr(model, 'predict_proba'):
+        return np.asarray(model.predict(X)).ravel()
+
+    return np.asarray(model.predict_proba(X))[:, -1]
+
+
+def measure_latency(model, X, n_repeats=3, n_single=100):
+
+    '''
+
+    Times how long a model takes to score data.
+
+    Parameters:
+        1. model - the trained model
+        2. X - the feature set to score
+        3. n_repeats - how many times to score the whole of X (the
+           fastest run is used)
+        4. n_single - how many single-row predictions to time
+
+    The output is a dictionary containing:
+        1. rows_per_second - throughput when scoring X in one batch
+        2. row_latency_ms - median time to score a single row, which is
+           the cost of scoring one patient at a time
+
+    '''
+
+    batch_times = []
+    for i in range(n_repeats):
+        start = time.perf_counter()
+        _predict(model, X)
+        batch_times.append(time.perf_counter() - start)
+
+    single_times = []
+    for i in range(min(n_single, X.shape[0])):
+        row = X[i:i + 1]
+        start = time.perf_counter()
+        _predict(model, row)
+        single_times.append(time.perf_counter() - start)
+
+    return {'rows_per_second': X.shape[0] / min(batch_times),
+            'row_latency_ms': 1000 * float(np.median(single_times))}
+
+
+def evaluate_models(model_names, X_test, y_test, feature_names=None,
+                    n_bootstrap=1000, ci=0.95, latency=True, n_jobs=None):
+
+    '''
+
+    Loads several trained model artifacts from S3 and scores them on the
+    test set, returning the AUC (with a bootstrap confidence interval) and
+    the scoring cost of each model.
+
+    Models are downloaded and scored concurrently using threads, so they
+    all share the same X_test array rather than each getting a copy. The
+    downloads share a single boto3 client, as creating clients from several
+    threads at once isn't thread-safe. Keras
+    models are scored in the main thread, as Keras (on TensorFlow 1) isn't
+    safe to predict from several threads at once. Latency is measured afterwards,
+    one model at a time, so that the timings aren't affected by the other
+    models running.
+
+    Parameters:
+        1. model_names - list of the models to test, eg ['random_forest']
+        2. X_test, y_test - the test feature set and target variable
+        3. feature_names - (optional) the features in X_test. If given,
+           each model is checked to have been trained on the same features
+        4. n_bootstrap - the number of bootstrap resamples for the AUC
+           confidence interval
+        5. ci - the width of the confidence interval
+        6. latency - if True, inference latency and throughput are measured
+        7. n_jobs - the number of threads (defaults to one per model)
+
+    The output is a DataFrame with one row per model.
+
+    '''
+
+    import boto3
+
+    n_jobs = max(1, n_jobs or len(model_names))
+    s3 = boto3.client('s3')
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+
+        artifacts = dict(zip(model_names,
+                             pool.map(lambda m: load_model_artifact(m, feature_names=feature_names,
+                                                                    s3=s3),
+                                      model_names)))
+
+        threaded = [m for m in model_names
+                    if artifacts[m]['metadata']['format'] != 'keras']
+        predictions = dict(zip(threaded,
+                               pool.map(lambda m: _predict(artifacts[m]['model'], X_test),
+                                        threaded)))
+
+    for m in model_names:
+        if m not in predictions:
+            predictions[m] = _predict(artifacts[m]['model'], X_test)
+
+    results = pd.DataFrame(index=model_names)
+    for m in model_names:
+
+        auc, lower, upper = bootstrap_auc(y_test, predictions[m],
+                                          n_bootstrap=n_bootstrap, ci=ci)
+        results.loc[m, 'auc'] = auc
+        results.loc[m, 'auc_lower'] = lower
+        results.loc[m, 'auc_upper'] = upper
+
+        if latency:
+            for k, v in measure_latency(artifacts[m]['model'], X_test).items():
+                results.loc[m, k] = v
+
+    results.index.name = 'model'
+
+    return results
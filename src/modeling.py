@@ -1,16 +1,11 @@
-import os
-import sys
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler, Imputer
 
-# Set up paths & import src functions
-project_root = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-src_folder = os.path.join(project_root, 'src')
-sys.path.insert(0, src_folder)
-from s3_storage import *
+from .s3_storage import from_s3, to_s3
+from .model_artifacts import save_model_artifact
 
-def final_cleaning(ids, target, train, test=None):
+def final_cleaning(ids, target, train, test=None, return_pipeline=False,
+                   diagnoses=None, target_diagnosis=None, sparse_output=False):
     
     '''
     
@@ -35,6 +30,24 @@ def final_cleaning(ids, target, train, test=None):
         2. target - the name of the target variable
         3. train - the training DataFrame
         4. test - the test DataFrame (optional)
+        5. return_pipeline - if True, the fitted imputer and scaler are also
+           returned (as a single sklearn Pipeline) so they can be saved
+           alongside the trained models
+        6. diagnoses - (optional) the output of diagnoses.diagnosis_matrix.
+           If given, the diagnoses of each admission (matched on hadm_id) are
+           added as extra binary features after the imputed and scaled
+           features
+        7. target_diagnosis - the ICD9 code (or list of codes) being
+           predicted, eg '5849'. Required when diagnoses is given, as these
+           columns are removed from the diagnosis features so the target
+           doesn't leak into them
+        8. sparse_output - if True (and diagnoses is given), X_train and
+           X_test are returned as sparse CSR matrices rather than dense
+           arrays. This saves memory when there are many diagnosis columns
+           (use min_count in diagnosis_matrix to limit them), but the chart
+           and lab features are fully dense, and as CSR they take about 1.5
+           times the memory of a dense array (an index is stored with every
+           value)
      
      The outputs are as follows:
         1. X_train - feature training set
@@ -42,9 +55,24 @@ def final_cleaning(ids, target, train, test=None):
         3. y_train - target variable for the training set
         4. y_test - target variable for the test set
         5. feature_names - the features from the feature set
+        6. pipeline - the fitted preprocessing (only if return_pipeline=True)
+
+    When diagnoses is given, the pipeline only transforms the chart and lab
+    features (the first columns of feature_names). The icd9_* columns need
+    no preprocessing, but when scoring new admissions they have to be added
+    after the pipeline with diagnoses.select_admissions, using the same
+    diagnosis matrix. Model artifacts record this split in their metadata
+    (preprocessing_features).
         
     '''
 
+    from sklearn.preprocessing import StandardScaler, Imputer
+    from sklearn.pipeline import Pipeline
+
+    if diagnoses is not None and target_diagnosis is None:
+        raise ValueError('target_diagnosis must be given with diagnoses, so '
+                         'the target can be removed from the features')
+
     if type(ids) == list:
         ids.append(target)
         drop_cols = ids.copy()
@@ -70,6 +98,8 @@ def final_cleaning(ids, target, train, test=None):
     scaler = StandardScaler() 
     scaler.fit(X_train)
     X_train = scaler.transform(X_train)
+
+    pipeline = Pipeline([('imputer', imputer), ('scaler', scaler)])
     
 
     # Apply the above operations on the test DataFrame
@@ -79,20 +109,48 @@ def final_cleaning(ids, target, train, test=None):
         y_test = np.array(test[target].tolist())
         X_test = imputer.transform(X_test)
         X_test = scaler.transform(X_test)
-        return X_train, X_test, y_train, y_test, feature_names
 
+    # Add the diagnoses of each admission as extra features
+    if diagnoses is not None:
+        from scipy import sparse
+        from .diagnoses import select_admissions, drop_diagnoses
+
+        diagnoses = drop_diagnoses(diagnoses, target_diagnosis)
+
+        def add_diagnoses(X, hadm_ids):
+            admission_diagnoses = select_admissions(diagnoses, hadm_ids)
+            if sparse_output:
+                return sparse.hstack([sparse.csr_matrix(X), admission_diagnoses],
+                                     format='csr')
+            return np.hstack([X, admission_diagnoses.toarray()])
+
+        X_train = add_diagnoses(X_train, train['hadm_id'])
+        feature_names = np.concatenate([feature_names,
+                                        ['icd9_{}'.format(c) for c in diagnoses['codes']]])
+
+        if type(test) == pd.DataFrame:
+            X_test = add_diagnoses(X_test, test['hadm_id'])
+
+    if type(test) == pd.DataFrame:
+        outputs = (X_train, X_test, y_train, y_test, feature_names)
     else:
-        return X_train, y_train, feature_names
+        outputs = (X_train, y_train, feature_names)
+
+    if return_pipeline:
+        return outputs + (pipeline,)
+    return outputs
 
 
-def final_run(X_train, y_train, best_params, classifier, model_name):
+def final_run(X_train, y_train, best_params, classifier, model_name,
+              feature_names, preprocessing=None, metrics=None, compress=0):
     
     '''
     
     The purpose of this function is to train a ML model with a given
     set of hyperparameters, and save the resulting model in AWS S3 as a
-    Pickle file. It is intended to be the final training run, after the
-    optimal hyperparameters have been found.
+    model artifact (see model_artifacts.write_model_artifact). It is
+    intended to be the final training run, after the optimal
+    hyperparameters have been found.
     
     Parameters:
         1. X_train - feature training set
@@ -101,6 +159,14 @@ def final_run(X_train, y_train, best_params, classifier, model_name):
            for the model training
         4. classifier - the name of the ML model/ library that will be trained
         5. model_name - used as the name when saving the trained model on S3
+        6. feature_names - the features in X_train, in order. Saved with the
+           model so that data passed to it later can be validated
+        7. preprocessing - (optional) the fitted preprocessing pipeline from
+           final_cleaning, bundled with the model
+        8. metrics - (optional) dict of scores to store with the model,
+           eg the best cross validation AUC
+        9. compress - joblib compression level. The default (0) keeps the
+           model uncompressed, so it loads without a decompression step
     
     '''
     
@@ -109,8 +175,10 @@ def final_run(X_train, y_train, best_params, classifier, model_name):
     model.fit(X_train, y_train)
     
     # Save model to S3
-    to_s3(obj=model,
-          bucket='mimic-jamesi',
-          filepath='models/{}'.format(model_name))
-    
-    
\ No newline at end of file
+    save_model_artifact(model=model,
+                        model_name=model_name,
+                        feature_names=feature_names,
+                        preprocessing=preprocessing,
+                        metrics=metrics,
+                        compress=compress,
+                        bucket='mimic-jamesi')
@@ -1,16 +1,9 @@
 # Import libraries
-import os
-import sys
 import pandas as pd
 import numpy as np
 
-# Set up paths
-project_root = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-src_folder = os.path.join(project_root, 'src')
-
 # Import src functions
-sys.path.insert(0, src_folder)
-from s3_storage import *
+from .s3_storage import from_s3
 
 
 def get_diagnosis_groups(diagnosis, optional_exclusions=None):
@@ -1,8 +1,6 @@
-import sys
 import os
-import boto3
-import botocore
 import pickle
+import tempfile
 import pandas as pd
 import numpy as np
 
@@ -18,20 +16,27 @@ def from_s3(bucket, filepath, index_col=None):
 
     '''
 
-    new_filename = filepath.split('/')[-1]
+    import boto3
+
     s3 = boto3.client('s3')
-    s3.download_file(bucket, filepath, new_filename)
 
-    if filepath.split('.')[-1] == 'csv':
-        obj = pd.read_csv(new_filename, index_col=index_col)
-    elif filepath.split('.')[-1] == 'npy':
-        obj = np.load(new_filename)
-    else:
-        new_filename = new_filename.split('.')[0]
-        with open(new_filename, 'rb') as file:  
-            obj = pickle.load(file)
+    # Download into a temporary directory so the result doesn't depend on
+    # (or clutter) the current working directory
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        new_filename = os.path.join(tmp_dir, filepath.split('/')[-1])
+        s3.download_file(bucket, filepath, new_filename)
 
-    os.remove(new_filename)
+        if filepath.split('.')[-1] == 'csv':
+            obj = pd.read_csv(new_filename, index_col=index_col)
+        elif filepath.split('.')[-1] == 'npy':
+            obj = np.load(new_filename)
+        elif filepath.split('.')[-1] == 'npz':
+            from scipy import sparse
+            obj = sparse.load_npz(new_filename)
+        else:
+            with open(new_filename, 'rb') as file:
+                obj = pickle.load(file)
 
     return obj
 
@@ -40,29 +45,88 @@ def to_s3(obj, bucket, filepath):
 
     '''
 
-    Function that saves either a DataFrame, np array or trained model onto S3.
+    Function that saves either a DataFrame (.csv filepath), np array (.npy),
+    scipy sparse matrix (.npz) or trained model (any other filepath) onto S3.
+    A ValueError is raised if the filepath's extension doesn't match the
+    object, as from_s3 reads files based on their extension.
 
     The AWS key and secret key must already be configured before this will
     run on any machine
 
     '''
 
-    s3 = boto3.client('s3')
-
     if type(obj) == pd.DataFrame:
-        obj.to_csv('out_file.csv')
-        s3.upload_file('out_file.csv', bucket, filepath)
-        os.remove('out_file.csv')
-
+        file_type = 'csv'
     elif type(obj) == np.ndarray:
-        np.save('out_file', obj)
-        s3.upload_file('out_file.npy', bucket, filepath)
-        os.remove('out_file.npy')
-        
+        file_type = 'npy'
+    elif type(obj).__module__.startswith('scipy.sparse'):
+        file_type = 'npz'
     else:
-        with open('out_file.pkl', 'wb') as file:  
-            pickle.dump(obj, file)
-        s3.upload_file('out_file.pkl', bucket, filepath)
-        os.remove('out_file.pkl')
-        
-        
\ No newline at end of file
+        file_type = 'pkl'
+
+    extension = filepath.split('.')[-1]
+    if (extension != file_type and
+            (file_type != 'pkl' or extension in ['csv', 'npy', 'npz'])):
+        raise ValueError('Cannot save a {} to {}. Use a .{} filepath'
+                         .format(type(obj).__name__, filepath,
+                                 file_type if file_type != 'pkl' else 'pkl (or no extension)'))
+
+    import boto3
+
+    s3 = boto3.client('s3')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        out_file = os.path.join(tmp_dir, 'out_file.{}'.format(file_type))
+
+        if file_type == 'csv':
+            obj.to_csv(out_file)
+
+        elif file_type == 'npy':
+            np.save(out_file, obj)
+
+        elif file_type == 'npz':
+            from scipy import sparse
+            sparse.save_npz(out_file, obj)
+
+        else:
+            with open(out_file, 'wb') as file:
+                pickle.dump(obj, file)
+
+        s3.upload_file(out_file, bucket, filepath)
+
+
+def file_from_s3(bucket, filepath, local_path, s3=None):
+
+    '''
+
+    Function that downloads a file from S3 to local_path as-is, without
+    loading it.
+
+    An existing boto3 S3 client can be passed in as s3. Clients are safe to
+    share between threads, whereas creating one per thread from the default
+    boto3 session is not.
+
+    '''
+
+    if s3 is None:
+        import boto3
+        s3 = boto3.client('s3')
+
+    s3.download_file(bucket, filepath, local_path)
+
+
+def file_to_s3(local_path, bucket, filepath, s3=None):
+
+    '''
+
+    Function that uploads a local file to S3 as-is, optionally using an
+    existing boto3 S3 client (see file_from_s3).
+
+    '''
+
+    if s3 is None:
+        import boto3
+        s3 = boto3.client('s3')
+
+    s3.upload_file(local_path, bucket, filepath)
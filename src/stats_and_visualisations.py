@@ -1,10 +1,207 @@
+import os
+import json
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 from itertools import combinations
 
 
+def kde_on_grid(values, grid, bandwidth=None):
+
+    '''
+
+    Estimates the density of a continuous feature on a fixed, evenly spaced
+    grid. The values are linearly binned onto the grid and the bin counts are
+    convolved with a Gaussian kernel using an FFT, so the cost depends on the
+    grid size rather than the number of observations.
+
+    Parameters:
+        1. values - (np.array) the observations, with NaNs already removed
+        2. grid - (np.array) evenly spaced points at which the density
+           should be evaluated
+        3. bandwidth - the standard deviation of the Gaussian kernel. If
+           omitted, Scott's rule is used (the same default as scipy's
+           gaussian_kde)
+
+    The output is an array of densities, one per grid point.
+
+    '''
+
+    values = np.asarray(values, dtype=float)
+    n = len(grid)
+    lo = grid[0]
+    dx = grid[1] - grid[0]
+
+    if bandwidth is None:
+        bandwidth = values.std(ddof=1) * len(values) ** (-1 / 5)
+
+    # Linear binning: split each observation between its two nearest grid points
+    pos = np.clip((values - lo) / dx, 0, n - 1)
+    left = np.minimum(np.floor(pos).astype(int), n - 2)
+    weight = pos - left
+    counts = (np.bincount(left, weights=1 - weight, minlength=n) +
+              np.bincount(left + 1, weights=weight, minlength=n))
+
+    # Gaussian kernel sampled at the grid spacing, truncated at 4 bandwidths.
+    # It is rescaled so it sums to 1 on the grid, otherwise a bandwidth close
+    # to (or below) the grid spacing would no longer integrate to 1
+    half_width = int(min(n - 1, np.ceil(4 * bandwidth / dx)))
+    offsets = np.arange(-half_width, half_width + 1) * dx
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel = kernel / (kernel.sum() * dx)
+
+    # Convolve the bin counts with the kernel through the FFT
+    fft_size = int(2 ** np.ceil(np.log2(n + 2 * half_width)))
+    smoothed = np.fft.irfft(np.fft.rfft(counts, fft_size) *
+                            np.fft.rfft(kernel, fft_size), fft_size)
+    density = smoothed[half_width:half_width + n] / len(values)
+
+    return np.maximum(density, 0)
+
+
+def kde_table(df, group_by, feature, grid_size=512, cut=3):
+
+    '''
+
+    Calculates the KDE of a continuous feature for all distinct groups of
+    patients on a single shared grid, so the groups can be compared directly.
+
+    Parameters:
+        1. df - the Pandas DataFrame containing the data
+        2. group_by - the column that differentiates the groups that
+           should be compared (eg, 'Gender' would compare Males v Females)
+        3. feature - the continuous variable who's distribution
+           should be estimated
+        4. grid_size - the number of points the density is evaluated at
+        5. cut - how many bandwidths the grid extends past the minimum and
+           maximum values (the same as seaborn's kdeplot)
+
+    The output is a dictionary containing:
+        1. grid - the points at which the densities were evaluated
+        2. groups - the groups found in the group_by column
+        3. density - array with one row of densities per group
+
+    Groups with fewer than 2 distinct values are left out, as a density
+    cannot be estimated for them.
+
+    '''
+
+    # Remove NaNs without modifying the input DataFrame
+    data = df[[group_by, feature]].dropna()
+
+    groups = []
+    values = []
+    bandwidths = []
+    for g, v in data.groupby(group_by)[feature]:
+        v = v.values.astype(float)
+        if len(np.unique(v)) < 2:
+            continue
+        groups.append(g)
+        values.append(v)
+        bandwidths.append(v.std(ddof=1) * len(v) ** (-1 / 5))
+
+    if not groups:
+        return {'grid': np.array([]), 'groups': [], 'density': np.empty((0, 0))}
+
+    # Shared grid across all groups
+    lo = min(v.min() for v in values) - cut * max(bandwidths)
+    hi = max(v.max() for v in values) + cut * max(bandwidths)
+    grid = np.linspace(lo, hi, grid_size)
+
+    density = np.vstack([kde_on_grid(v, grid, bandwidth=bw)
+                         for v, bw in zip(values, bandwidths)])
+
+    return {'grid': grid, 'groups': groups, 'density': density}
+
+
+def perc_tables(df, group_by, features, value):
+
+    '''
+
+    Calculates the percentage tables used by plot_perc_bar_chart for several
+    discrete features at once, using a single groupby over the data rather
+    than one per feature.
+
+    Parameters:
+        1. df - the input dataframe
+        2. group_by - the primary column to be grouped by
+        3. features - list of the secondary columns to be grouped by
+        4. value - the column to be counted
+
+    The output is a dictionary with one DataFrame per feature, containing
+    the group_by column, the feature column and 'perc' (the proportion of
+    unique values in each category for each group).
+
+    '''
+
+    if not features:
+        return {}
+
+    long_df = (df[[group_by, value] + features]
+                 .melt(id_vars=[group_by, value],
+                       var_name='feature', value_name='category'))
+
+    t = (long_df.groupby([group_by, 'feature', 'category'])
+                .agg({value: 'nunique'})
+                .reset_index()
+                .rename(columns={value:'col'}))
+    t['tot'] = t.groupby([group_by, 'feature']).col.transform('sum')
+    t['perc'] = t['col'] / t['tot']
+
+    tables = {}
+    for f in features:
+        tables[f] = (t.loc[t['feature'] == f, [group_by, 'category', 'perc']]
+                      .rename(columns={'category': f})
+                      .reset_index(drop=True))
+
+    return tables
+
+
+def _new_figure(headless=False):
+
+    '''
+    Creates a new figure and axes. When headless is True the figure is drawn
+    with the Agg canvas directly rather than through pyplot, so it works on
+    machines without a display whatever the default backend is.
+    '''
+
+    if headless:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        fig = Figure(figsize = (7, 5))
+        FigureCanvasAgg(fig)
+        return fig, fig.add_subplot(111)
+
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize = (7, 5))
+    return fig, fig.add_subplot(111)
+
+
+def _draw_kde(table, feature, ax):
+
+    ''' Draws the output of kde_table onto ax '''
+
+    for g, d in zip(table['groups'], table['density']):
+        ax.plot(table['grid'], d, label = g)
+
+    # Labeling of plot
+    ax.legend()
+    ax.set_xlabel(feature);
+    ax.set_ylabel('Density');
+    ax.set_title(feature);
+
+
+def _draw_perc_bar_chart(t, group_by, feature, ax):
+
+    ''' Draws a percentage table onto ax '''
+
+    import seaborn as sns
+
+    sns.barplot(data=t, x=feature, y="perc", hue=group_by, ax=ax)
+    ax.tick_params(axis='x', labelrotation=90)
+
+
 def plot_KDE(df, group_by, feature):
 
     '''
@@ -22,25 +219,11 @@ def plot_KDE(df, group_by, feature):
 
     '''
 
-    plt.figure(figsize = (7, 5))
-
-    #Remove NaNs
-    df = df[[group_by, feature]]
-    df.dropna(inplace=True)
-
-    # KDE plots for each of the groups
-    groups = list(df[group_by].unique())
-    for g in groups:
-        sns.kdeplot(df.loc[df[group_by] == g, feature], label = g)
-
-    # Labeling of plot
-    plt.xlabel(feature);
-    plt.ylabel('Density');
-    plt.title(feature);
+    import matplotlib.pyplot as plt
 
+    fig, ax = _new_figure()
+    _draw_kde(kde_table(df, group_by, feature), feature, ax)
     plt.show()
-    
-    del df
     plt.clf()
 
 
@@ -64,49 +247,160 @@ def plot_perc_bar_chart(df, group_by, feature, value):
 
     '''
 
-    plt.figure(figsize = (7, 5))
-    
-    t = (df.groupby([group_by, feature])
-           .agg({value: 'nunique'})
-           .reset_index()
-           .rename(columns={value:'col'}))
-    t['tot'] = t.groupby(group_by).col.transform('sum')
-    t['perc'] = t['col'] / t['tot']
+    import matplotlib.pyplot as plt
 
-    # Plot
-    sns.barplot(data=t, x=feature, y="perc", hue=group_by)
-    plt.xticks(rotation='vertical');
+    t = perc_tables(df, group_by, [feature], value)[feature]
+    fig, ax = _new_figure()
+    _draw_perc_bar_chart(t, group_by, feature, ax)
     plt.show()
-    
-    del t
     plt.clf()
 
 
+def comparison_summary(df, ids, group_col,
+                       plot=['age_on_admission',
+                             'age_adm_bucket',
+                             'gender',
+                             'ethnicity_simple'],
+                       grid_size=512):
+
+    '''
+
+    Calculates everything graph_comparisons needs to plot, without drawing
+    anything. Discrete features get a percentage table and
+    continuous features get a KDE on a fixed grid.
+
+    Parameters:
+        1. df - the input dataframe
+        2. ids - the column to be counted for the discrete features
+        3. group_col - the column that differentiates the groups
+        4. plot - the features to be compared
+        5. grid_size - the number of points each KDE is evaluated at
+
+    The output is a dictionary that can be passed to
+    plot_comparison_summary, or saved with save_comparison_summary and
+    reloaded in a later run with load_comparison_summary.
+
+    '''
+
+    continuous = [p for p in plot if pd.api.types.is_numeric_dtype(df[p])]
+    discrete = [p for p in plot if p not in continuous]
+
+    return {'group_col': group_col,
+            'features': list(plot),
+            'perc': perc_tables(df, group_col, discrete, ids),
+            'kde': {p: kde_table(df, group_col, p, grid_size=grid_size)
+                    for p in continuous}}
+
+
+def plot_comparison_summary(summary, output_dir=None):
+
+    '''
+
+    Plots the output of comparison_summary: bar charts for the discrete
+    features and KDEs for the continuous features.
+
+    If output_dir is given, each chart is saved there as '<feature>.png'
+    instead of being shown. The charts are then drawn with the Agg canvas
+    rather than pyplot, so this can run without a display.
+
+    '''
+
+    group_col = summary['group_col']
+    headless = bool(output_dir)
+
+    if headless:
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+    else:
+        import matplotlib.pyplot as plt
+
+    for p in summary['features']:
+
+        fig, ax = _new_figure(headless=headless)
+
+        if p in summary['perc']:
+            _draw_perc_bar_chart(summary['perc'][p], group_col, p, ax)
+        else:
+            _draw_kde(summary['kde'][p], p, ax)
+
+        if headless:
+            fig.savefig(os.path.join(output_dir, '{}.png'.format(p)),
+                        bbox_inches='tight')
+        else:
+            plt.show()
+            plt.clf()
+
+
+def _to_python(obj):
+
+    ''' Converts numpy types so they can be written to JSON '''
+
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('{} is not JSON serializable'.format(type(obj)))
+
+
+def save_comparison_summary(summary, filepath):
+
+    ''' Saves the output of comparison_summary as a JSON file '''
+
+    out = {'group_col': summary['group_col'],
+           'features': summary['features'],
+           'perc': {f: t.to_dict(orient='list')
+                    for f, t in summary['perc'].items()},
+           'kde': summary['kde']}
+
+    directory = os.path.dirname(filepath)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(filepath, 'w') as file:
+        json.dump(out, file, default=_to_python)
+
+
+def load_comparison_summary(filepath):
+
+    ''' Loads a comparison summary saved by save_comparison_summary '''
+
+    with open(filepath, 'r') as file:
+        summary = json.load(file)
+
+    summary['perc'] = {f: pd.DataFrame(t) for f, t in summary['perc'].items()}
+    for table in summary['kde'].values():
+        table['grid'] = np.array(table['grid'])
+        table['density'] = np.array(table['density'])
+
+    return summary
+
 
 def graph_comparisons(df, ids, group_col,
                       plot=['age_on_admission',
                             'age_adm_bucket',
                             'gender',
-                            'ethnicity_simple']):
+                            'ethnicity_simple'],
+                      output_dir=None):
     
     ''' wrapper for plot_perc_bar_chart and plot_KDE that
         uses the former if the data in 'plot' is discrete
-        and the latter if it is continuous '''
+        and the latter if it is continuous.
+
+        All the plotting data is calculated up front with
+        comparison_summary, which is returned so it can be
+        re-plotted or saved. If output_dir is given, the charts
+        and the summary (summary.json) are saved there rather
+        than shown. '''
     
-    for p in plot:
+    summary = comparison_summary(df, ids, group_col, plot=plot)
 
-        if df[p].dtype == 'O':
-            # Bar chart for discrete variables
-            plot_perc_bar_chart(df = df,
-                                group_by = group_col,
-                                feature = p,
-                                value = ids)
+    if output_dir:
+        save_comparison_summary(summary,
+                                os.path.join(output_dir, 'summary.json'))
 
-        else:
-            # KDE plot for continuous variables
-            plot_KDE(df = df,
-                     group_by = group_col,
-                     feature = p)
+    plot_comparison_summary(summary, output_dir=output_dir)
+
+    return summary
 
 
 
@@ -125,6 +419,9 @@ def best_cv_by_run(results, cv_score):
         2. cv_score - the column that contains the cross validation scores
     
     '''
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     
     # Find the ongoing best CV score by run number
     results.sort_index(ascending=True, inplace=True)
@@ -164,6 +461,8 @@ def plot_single_results(results, training_score, cv_score, params_dict):
     plotted.
     
     '''
+
+    import matplotlib.pyplot as plt
     
     params = [param for param in results.columns
               if param not in [training_score, cv_score, params_dict]]
@@ -204,6 +503,8 @@ def plot_loss_by_epoch(df, x_axis='epochs', display_points=50):
            the x axis (reduced from the total number of epochs
            for readability)
     '''
+
+    import matplotlib.pyplot as plt
     
     # Find labels for the x axis: lr or epochs
     if x_axis == 'lr':
@@ -256,6 +557,8 @@ def plot_neural_net_hyperparam(results_df, hyperparam, train_score, valid_score)
     
     '''
 
+    import matplotlib.pyplot as plt
+
     # Find the values and labels to be plotted
     x_labels = results_df[hyperparam].tolist()
     x = np.arange(len(x_labels))
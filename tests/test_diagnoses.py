@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from src.diagnoses import (icd9_rollup, diagnosis_matrix, select_admissions,
+                           drop_diagnoses, diagnosis_targets)
+
+
+def _admissions():
+    return pd.DataFrame({'hadm_id': [10, 10, 20, 20, 30, 30],
+                         'diagnosis_icd9': ['5849', '5845', '4019', 'V3000',
+                                            'E8497', np.nan]})
+
+
+def test_icd9_rollup():
+    codes = ['5849', '4019', 'V3000', 'E8497', '0389']
+
+    assert list(icd9_rollup(codes, level='full')) == codes
+    assert list(icd9_rollup(codes, level='category')) == \
+        ['584', '401', 'V30', 'E849', '038']
+    assert list(icd9_rollup(codes, level='chapter')) == \
+        ['580-629', '390-459', 'V', 'E', '001-139']
+
+
+def test_diagnosis_matrix_rolls_up_to_binary():
+    d = diagnosis_matrix(_admissions(), level='category')
+
+    assert list(d['hadm_ids']) == [10, 20, 30]
+    assert list(d['codes']) == ['401', '584', 'E849', 'V30']
+    # The two 584 codes of admission 10 become a single 1
+    assert d['matrix'].toarray().tolist() == [[0, 1, 0, 0],
+                                             [1, 0, 0, 1],
+                                             [0, 0, 1, 0]]
+
+
+def test_select_admissions_reorders_and_fills_missing():
+    d = diagnosis_matrix(_admissions())
+
+    selected = select_admissions(d, [30, 99, 10]).toarray()
+    full = d['matrix'].toarray()
+
+    np.testing.assert_array_equal(selected[0], full[2])
+    np.testing.assert_array_equal(selected[1], 0)
+    np.testing.assert_array_equal(selected[2], full[0])
+
+
+def test_drop_diagnoses_uses_matrix_level():
+    d = drop_diagnoses(diagnosis_matrix(_admissions(), level='category'), '5849')
+
+    assert list(d['codes']) == ['401', 'E849', 'V30']
+    assert d['matrix'].shape == (3, 3)
+
+
+def test_diagnosis_targets():
+    d = diagnosis_matrix(_admissions(), level='category')
+
+    Y, codes = diagnosis_targets(d, [20, 10], codes=['584', 'V30'])
+
+    assert list(codes) == ['584', 'V30']
+    assert Y.toarray().tolist() == [[0, 1], [1, 0]]
@@ -0,0 +1,25 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ['boto3', 'botocore', 'matplotlib', 'seaborn', 'sklearn', 'scipy',
+         'lightgbm', 'keras']
+
+
+@pytest.mark.parametrize('module', ['src.modeling', 'src.generate_datasets',
+                                    'src.incremental', 'src.model_artifacts',
+                                    'src.model_evaluation', 'src.diagnoses',
+                                    'src.stats_and_visualisations',
+                                    'src.patient_selection', 'src.s3_storage'])
+def test_import_does_not_load_heavy_dependencies(module):
+    # A fresh interpreter, so modules imported by other tests don't count
+    code = ('import sys, {}; '
+            'print(" ".join(m for m in {!r} if m in sys.modules))'
+            .format(module, HEAVY))
+    loaded = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=ROOT).decode().split()
+
+    assert loaded == []
@@ -0,0 +1,64 @@
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.utils.class_weight import compute_class_weight
+
+from src.incremental import (iter_batches, balanced_class_weights,
+                             partial_fit_batches, _fingerprint)
+
+
+def _data(n=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(n, 4))
+    y = (X[:, 0] + 0.5 * rng.normal(size=n) > 0).astype(int)
+    return X, y
+
+
+def test_iter_batches_covers_each_row_once_and_keeps_alignment():
+    # Column 0 holds the row number, and y is derived from it
+    X = np.column_stack([np.arange(103), np.random.RandomState(0).rand(103)])
+    y = np.arange(103) * 10
+
+    batches = list(iter_batches(X, y, batch_size=10, shuffle=True))
+    rows = np.concatenate([X_batch[:, 0] for X_batch, y_batch in batches])
+    labels = np.concatenate([y_batch for X_batch, y_batch in batches])
+
+    assert sorted(rows) == list(range(103))
+    np.testing.assert_array_equal(labels, rows * 10)
+    # The batches really were shuffled
+    assert list(rows) != list(range(103))
+
+
+def test_balanced_class_weights_matches_sklearn():
+    y = np.array([0] * 70 + [1] * 20 + [2] * 10)
+
+    weights = balanced_class_weights(y)
+    expected = compute_class_weight('balanced', classes=np.unique(y), y=y)
+
+    np.testing.assert_allclose([weights[c] for c in [0, 1, 2]], expected)
+
+
+def test_fingerprint_changes_with_data_and_params():
+    X, y = _data(n=50)
+    base = _fingerprint(X, y, {'max_bin': 255}, chunk_size=20)
+
+    X_changed = X.copy()
+    X_changed[-1, -1] += 1e-12
+
+    assert _fingerprint(X.copy(), y.copy(), {'max_bin': 255}, chunk_size=20) == base
+    assert _fingerprint(X_changed, y, {'max_bin': 255}, chunk_size=20) != base
+    assert _fingerprint(X, 1 - y, {'max_bin': 255}, chunk_size=20) != base
+    assert _fingerprint(X, y, {'max_bin': 63}, chunk_size=20) != base
+
+
+def test_partial_fit_batches_on_memmap_matches_array(tmpdir):
+    X, y = _data()
+    path = str(tmpdir.join('X.npy'))
+    np.save(path, X)
+    X_mm = np.load(path, mmap_mode='r')
+
+    def fit(X_train):
+        model = SGDClassifier(random_state=0)
+        return partial_fit_batches(model, X_train, y, batch_size=100, epochs=3)
+
+    np.testing.assert_array_equal(fit(X_mm).decision_function(X),
+                                  fit(X).decision_function(X))
@@ -0,0 +1,129 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from src.model_artifacts import (write_model_artifact, read_model_artifact,
+                                 save_model_artifact, load_model_artifact,
+                                 check_features, METADATA_FILE)
+
+FEATURES = ['creatinine', 'urea', 'potassium']
+
+
+def _model():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(100, 3))
+    y = (X[:, 0] > 0).astype(int)
+    pipeline = Pipeline([('scaler', StandardScaler())]).fit(X)
+    model = LogisticRegression().fit(pipeline.transform(X), y)
+    return X, model, pipeline
+
+
+@pytest.mark.parametrize('compress', [0, 3])
+def test_round_trip(tmpdir, compress):
+    X, model, pipeline = _model()
+    directory = str(tmpdir.join('artifact'))
+
+    write_model_artifact(directory, model, 'logistic_regression', FEATURES,
+                         preprocessing=pipeline, metrics={'cv_auc': 0.9},
+                         compress=compress)
+    artifact = read_model_artifact(directory, feature_names=FEATURES)
+
+    expected = model.predict_proba(pipeline.transform(X))
+    loaded = artifact['model'].predict_proba(artifact['preprocessing'].transform(X))
+    np.testing.assert_array_equal(loaded, expected)
+
+    metadata = artifact['metadata']
+    assert metadata['features'] == FEATURES
+    assert metadata['preprocessing_features'] == FEATURES
+    assert metadata['metrics'] == {'cv_auc': 0.9}
+    assert metadata['compress'] == compress
+
+
+def test_check_features():
+    metadata = {'model_name': 'logistic_regression', 'features': FEATURES}
+
+    check_features(metadata, FEATURES)
+
+    with pytest.raises(ValueError, match='different order'):
+        check_features(metadata, FEATURES[::-1])
+    with pytest.raises(ValueError, match="Missing: \\['potassium'\\], unexpected: \\['sodium'\\]"):
+        check_features(metadata, ['creatinine', 'urea', 'sodium'])
+
+
+def test_newer_artifact_version_is_rejected(tmpdir):
+    X, model, pipeline = _model()
+    directory = str(tmpdir)
+    write_model_artifact(directory, model, 'logistic_regression', FEATURES)
+
+    path = os.path.join(directory, METADATA_FILE)
+    with open(path) as file:
+        metadata = json.load(file)
+    metadata['artifact_version'] += 1
+    with open(path, 'w') as file:
+        json.dump(metadata, file)
+
+    with pytest.raises(ValueError, match='newer'):
+        read_model_artifact(directory)
+
+
+def test_preprocessing_must_cover_features(tmpdir):
+    X, model, pipeline = _model()
+
+    # Diagnosis features after the pipeline's output are allowed
+    metadata = write_model_artifact(str(tmpdir.join('a')), model, 'lr',
+                                    FEATURES + ['icd9_584'],
+                                    preprocessing=pipeline)
+    assert metadata['preprocessing_features'] == FEATURES
+
+    with pytest.raises(ValueError, match='outputs 3 features'):
+        write_model_artifact(str(tmpdir.join('b')), model, 'lr',
+                             FEATURES + ['sodium'], preprocessing=pipeline)
+
+
+class FakeS3:
+
+    ''' Stands in for a boto3 S3 client, storing files in a local directory '''
+
+    def __init__(self, root):
+        self.root = root
+        self.downloads = []
+
+    def upload_file(self, local_path, bucket, filepath):
+        target = os.path.join(self.root, filepath)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copy(local_path, target)
+
+    def download_file(self, bucket, filepath, local_path):
+        self.downloads.append(filepath)
+        shutil.copy(os.path.join(self.root, filepath), local_path)
+
+
+def test_load_reuses_cache_until_model_changes(tmpdir, monkeypatch):
+    import src.model_artifacts as model_artifacts
+
+    X, model, pipeline = _model()
+    s3 = FakeS3(str(tmpdir.join('s3')))
+    cache_dir = str(tmpdir.join('cache'))
+    monkeypatch.setattr(model_artifacts, 'file_to_s3',
+                        lambda local_path, bucket, filepath: s3.upload_file(local_path, bucket, filepath))
+
+    save_model_artifact(model, 'logistic_regression', FEATURES)
+    load_model_artifact('logistic_regression', cache_dir=cache_dir, s3=s3)
+    assert len(s3.downloads) == 2
+
+    # Unchanged, so only the metadata is downloaded
+    load_model_artifact('logistic_regression', cache_dir=cache_dir, s3=s3)
+    assert len(s3.downloads) == 3
+
+    save_model_artifact(model, 'logistic_regression', FEATURES,
+                        metrics={'cv_auc': 0.9})
+    artifact = load_model_artifact('logistic_regression', cache_dir=cache_dir, s3=s3)
+    assert len(s3.downloads) == 5
+    assert artifact['metadata']['metrics'] == {'cv_auc': 0.9}
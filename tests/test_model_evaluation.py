@@ -0,0 +1,51 @@
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+from src.model_evaluation import bootstrap_auc, _grouped_weights, _weighted_auc
+
+
+def _scores(n=300, seed=0):
+    rng = np.random.RandomState(seed)
+    y_true = rng.randint(0, 2, n)
+    # Rounded so there are plenty of tied scores
+    y_score = np.round(0.3 * y_true + rng.rand(n), 1)
+    return y_true, y_score
+
+
+def test_weighted_auc_matches_roc_auc_score_on_resamples():
+    y_true, y_score = _scores()
+    order, labels, starts = _grouped_weights(y_true.astype(float), y_score)
+
+    rng = np.random.RandomState(1)
+    idx = rng.randint(0, len(y_true), size=(20, len(y_true)))
+    counts = np.array([np.bincount(i, minlength=len(y_true)) for i in idx])
+
+    aucs = _weighted_auc(counts[:, order], labels, starts)
+    expected = [roc_auc_score(y_true[i], y_score[i]) for i in idx]
+
+    np.testing.assert_allclose(aucs, expected)
+
+
+def test_bootstrap_auc_matches_roc_auc_score_loop():
+    y_true, y_score = _scores()
+
+    auc, lower, upper = bootstrap_auc(y_true, y_score, n_bootstrap=200,
+                                      random_state=8)
+
+    rng = np.random.RandomState(8)
+    idx = rng.randint(0, len(y_true), size=(200, len(y_true)))
+    expected = [roc_auc_score(y_true[i], y_score[i]) for i in idx]
+
+    assert np.isclose(auc, roc_auc_score(y_true, y_score))
+    np.testing.assert_allclose([lower, upper],
+                               np.percentile(expected, [2.5, 97.5]))
+
+
+def test_bootstrap_auc_chunks_give_same_interval():
+    y_true, y_score = _scores()
+
+    whole = bootstrap_auc(y_true, y_score, n_bootstrap=100)
+    chunked = bootstrap_auc(y_true, y_score, n_bootstrap=100,
+                            max_chunk=7 * len(y_true))
+
+    np.testing.assert_allclose(whole, chunked)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from src.stats_and_visualisations import kde_on_grid, kde_table, perc_tables
+
+
+def test_kde_on_grid_integrates_to_one():
+    values = np.random.RandomState(0).normal(50, 5, 1000)
+    grid = np.linspace(0, 100, 101)
+    dx = grid[1] - grid[0]
+
+    # Including bandwidths below the grid spacing
+    for bandwidth in [None, 0.1, 0.5, 1, 3]:
+        density = kde_on_grid(values, grid, bandwidth=bandwidth)
+        assert abs(density.sum() * dx - 1) < 1e-3
+
+
+def test_kde_on_grid_matches_gaussian_kde():
+    from scipy.stats import gaussian_kde
+
+    values = np.random.RandomState(1).normal(60, 15, 5000)
+    grid = np.linspace(0, 120, 512)
+
+    expected = gaussian_kde(values)(grid)
+    assert np.abs(kde_on_grid(values, grid) - expected).max() < 1e-3 * expected.max()
+
+
+def test_kde_table_skips_constant_groups():
+    df = pd.DataFrame({'target': [0, 0, 0, 1, 1, 1],
+                       'creatinine': [1.0, 2.0, np.nan, 3.0, 3.0, 3.0]})
+
+    table = kde_table(df, 'target', 'creatinine', grid_size=64)
+
+    assert table['groups'] == [0]
+    assert table['density'].shape == (1, 64)
+
+
+def test_perc_tables_matches_per_feature_groupby():
+    df = pd.DataFrame({'target': [0, 0, 0, 1, 1, 1],
+                       'hadm_id': [1, 2, 3, 4, 5, 5],
+                       'gender': ['M', 'F', 'F', 'M', 'M', 'M']})
+
+    t = perc_tables(df, 'target', ['gender'], 'hadm_id')['gender']
+    perc = t.set_index(['target', 'gender'])['perc']
+
+    assert perc[(0, 'F')] == 2 / 3
+    assert perc[(0, 'M')] == 1 / 3
+    assert perc[(1, 'M')] == 1.0